@@ -6,6 +6,7 @@ import base64
 import hashlib
 import hmac
 import os
+from functools import lru_cache
 
 from dotenv import load_dotenv
 from twilio.base.exceptions import TwilioException
@@ -134,6 +135,7 @@ async def get_account_balance() -> float:
         raise Exception(f"Error fetching account balance: {str(e)}")
 
 
+@lru_cache(maxsize=1024)
 def format_phone_number(phone: str) -> str:
     """
     Format a phone number to E.164 format for Twilio.
@@ -4,6 +4,7 @@ Test runner script for the SMS Outreach Backend.
 Runs test suites based on category flags or all tests by default.
 """
 
+import os
 import subprocess
 import sys
 import time
@@ -21,7 +22,9 @@ def run_command(cmd: List[str], suite_name: str) -> Tuple[bool, float]:
     
     start_time = time.time()
     try:
-        result = subprocess.run(cmd, check=False)
+        # Test processes and xdist workers skip writing __pycache__ for every imported module
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+        result = subprocess.run(cmd, check=False, env=env)
         execution_time = time.time() - start_time
         
         if result.returncode == 0:
@@ -84,6 +87,8 @@ def main():
     parser.add_argument("--utils", action="store_true", help="Run utility tests only")
     parser.add_argument("--performance", action="store_true", help="Run performance tests only")
     parser.add_argument("--verbose", "-v", action="store_true", help="Show detailed test output")
+    parser.add_argument("--workers", "-n", type=int, default=None,
+                        help="Number of pytest-xdist workers per suite (default: auto, 0 runs serially)")
     
     args = parser.parse_args()
     
@@ -116,6 +121,11 @@ def main():
         if args.performance: categories.append("Performance")
         print(f"Running {', '.join(categories)} tests only")
     
+    # pytest.ini shards every suite with -n auto; only override when a worker count is given
+    if args.workers is not None:
+        for suite in selected_suites:
+            suite["cmd"] = suite["cmd"] + ["-n", str(args.workers)]
+    
     results = []
     total_start_time = time.time()
     
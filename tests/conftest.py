@@ -3,13 +3,20 @@ Test configuration and fixtures for the SMS Outreach Backend test suite.
 """
 
 import pytest
+import pytest_asyncio
 import os
 import sys
 from unittest.mock import Mock, patch
+from fastapi.testclient import TestClient
+from httpx import AsyncClient, ASGITransport
 
 # Add the app directory to the Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+# Test data
+VALID_API_KEY = "sms_backend_2025_secure_key_xyz789"
+INVALID_API_KEY = "invalid_key"
+
 @pytest.fixture(scope="session")
 def mock_environment():
     """Mock environment variables for testing."""
@@ -20,10 +27,74 @@ def mock_environment():
         'TWILIO_AUTH_TOKEN': 'test_twilio_token',
         'TWILIO_PHONE_NUMBER': '+1234567890',
         'OPENAI_API_KEY': 'test_openai_key',
-        'API_KEY': 'sms_backend_2025_secure_key_xyz789'
+        'API_KEY': VALID_API_KEY
     }):
         yield
 
+@pytest.fixture(scope="session")
+def client():
+    """Shared TestClient for the mocked app, entered once so lifespan and connection setup run once per session."""
+    from tests.test_app import mock_app
+    with TestClient(mock_app, backend="asyncio", raise_server_exceptions=False) as c:
+        yield c
+
+@pytest.fixture(scope="session")
+def auth_headers():
+    """Headers for authenticated JSON requests, built once per session."""
+    return {"X-API-Key": VALID_API_KEY, "Content-Type": "application/json"}
+
+@pytest_asyncio.fixture
+async def async_client():
+    """Async client so concurrent requests actually overlap on the app's event loop."""
+    from tests.test_app import mock_app
+    # Follow the routers' trailing-slash redirects like TestClient does
+    async with AsyncClient(transport=ASGITransport(app=mock_app), base_url="http://test", follow_redirects=True) as ac:
+        yield ac
+
+def _swap_collection(monkeypatch, getter_name):
+    """Point every lookup of a collection getter at a fresh FakeCollection."""
+    from tests.test_app import FakeCollection
+    fake = FakeCollection()
+    # Routes import the getter by name, so patch their bindings as well as the source module
+    for target in ("app.database", "app.routes.customers", "app.routes.messages"):
+        monkeypatch.setattr(f"{target}.{getter_name}", lambda: fake)
+    return fake
+
+@pytest.fixture
+def fake_customers(monkeypatch):
+    """Fresh in-memory customers collection, swapped in wherever the routes look it up."""
+    return _swap_collection(monkeypatch, "get_customers_collection")
+
+@pytest.fixture
+def fake_messages(monkeypatch):
+    """Fresh in-memory messages collection, swapped in wherever the routes look it up."""
+    return _swap_collection(monkeypatch, "get_messages_collection")
+
+@pytest.fixture(scope="session")
+def firebase_available():
+    """Probe Firebase once per session; the env check runs first so unconfigured runs never wait on the SDK."""
+    if not _firebase_configured():
+        return False
+    try:
+        from app.database import get_firestore_client
+        get_firestore_client()
+        return True
+    except Exception:
+        return False
+
+@pytest.fixture(autouse=True)
+def _bust_lru_caches():
+    """Clear lru_caches in the app utilities after each test so no test sees another's cached results."""
+    yield
+    # Only modules already imported; importing here would demand API keys before a test needs them
+    for name in ("app.utils.llm_client", "app.utils.twilio_client"):
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+        for obj in vars(module).values():
+            if hasattr(obj, "cache_clear"):
+                obj.cache_clear()
+
 @pytest.fixture
 def mock_firebase():
     """Mock Firebase operations."""
@@ -77,9 +148,38 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "twilio: mark test as requiring Twilio")
     config.addinivalue_line("markers", "firebase: mark test as requiring Firebase")
 
+def _firebase_configured():
+    """Check whether Firebase credentials are available (env vars only, no network)."""
+    cred_path = os.getenv("FIREBASE_CRED_PATH")
+    return bool(cred_path and os.getenv("FIREBASE_PROJECT_ID") and os.path.exists(cred_path))
+
+def _openai_configured():
+    """Check whether a real OpenAI API key is configured."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    return bool(api_key) and api_key != "test_openai_key"
+
+def _twilio_configured():
+    """Check whether real Twilio credentials are configured."""
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    return (bool(account_sid and os.getenv("TWILIO_AUTH_TOKEN") and os.getenv("TWILIO_PHONE_NUMBER"))
+            and account_sid != "test_twilio_sid")
+
 def pytest_collection_modifyitems(config, items):
     """Modify test collection to add markers based on test names."""
+    # Skip integration tests for unconfigured services before any fixture runs
+    service_skips = {
+        "firebase": (_firebase_configured(), "Firebase not configured for integration testing"),
+        "openai": (_openai_configured(), "OpenAI API key not configured for integration testing"),
+        "twilio": (_twilio_configured(), "Twilio not configured for integration testing"),
+    }
+    
     for item in items:
+        if "integration" in item.keywords:
+            for service, (configured, reason) in service_skips.items():
+                if not configured and service in item.keywords:
+                    item.add_marker(pytest.mark.skip(reason=reason))
+                    break
+        
         # Add unit test marker to all tests in test_main.py
         if "test_main" in item.nodeid:
             item.add_marker(pytest.mark.unit)
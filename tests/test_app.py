@@ -3,6 +3,9 @@ Test-specific FastAPI app configuration that doesn't initialize real Firebase.
 """
 
 from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Any, Dict, Iterator, Optional
 from fastapi import FastAPI, Depends
 from unittest.mock import Mock, patch, MagicMock
 import sys
@@ -31,6 +34,90 @@ mock_customers_collection.document.return_value = default_doc_ref
 mock_messages_collection.add.return_value = (None, default_doc_ref)
 mock_messages_collection.document.return_value = default_doc_ref
 
+# Resolve the where().stream() chains once so tests only rebind the final return value
+mock_customers_collection.where.return_value.stream.return_value = []
+mock_messages_collection.where.return_value.stream.return_value = []
+
+def set_document_get(collection, doc):
+    """Make collection.document(...).get() return doc."""
+    collection.document.return_value.get.return_value = doc
+
+def set_where_stream(collection, docs):
+    """Make collection.where(...).stream() return docs."""
+    collection.where.return_value.stream.return_value = docs
+
+# Lightweight Firestore doubles - plain attribute access instead of Mock's child-mock machinery
+@dataclass(slots=True)
+class FakeDocSnap:
+    """Stand-in for a Firestore DocumentSnapshot."""
+    id: str
+    exists: bool = True
+    data: Optional[Dict[str, Any]] = None
+
+    @property
+    def reference(self) -> "FakeDocRef":
+        return FakeDocRef(self.id, self)
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self.data or {}) if self.exists else None
+
+
+@dataclass(slots=True)
+class FakeDocRef:
+    """Stand-in for a Firestore DocumentReference backed by a single snapshot."""
+    id: str
+    snapshot: Optional[FakeDocSnap] = None
+
+    def get(self) -> FakeDocSnap:
+        if self.snapshot is None:
+            return FakeDocSnap(self.id, exists=False)
+        return self.snapshot
+
+    def update(self, data: Dict[str, Any]) -> None:
+        if self.snapshot is None:
+            # Refs built without a snapshot (e.g. stubbed add() results) record the update on a fresh one
+            self.snapshot = FakeDocSnap(self.id, data=dict(data))
+            return
+        self.snapshot.data = {**(self.snapshot.data or {}), **data}
+
+    def delete(self) -> None:
+        if self.snapshot is not None:
+            self.snapshot.exists = False
+
+
+@dataclass(slots=True)
+class FakeCollection:
+    """Stand-in for a Firestore CollectionReference holding snapshots in a dict.
+
+    Query methods (where/limit/offset/order_by) return the collection itself,
+    so stream() yields every existing document regardless of filters.
+    """
+    docs: Dict[str, FakeDocSnap] = field(default_factory=dict)
+    _ids: Iterator[int] = field(default_factory=count)
+
+    def document(self, doc_id: str) -> FakeDocRef:
+        return FakeDocRef(doc_id, self.docs.get(doc_id))
+
+    def add(self, data: Dict[str, Any]) -> tuple:
+        doc_id = f"fake_doc_{next(self._ids)}"
+        self.docs[doc_id] = FakeDocSnap(doc_id, data=dict(data))
+        return None, FakeDocRef(doc_id, self.docs[doc_id])
+
+    def where(self, *args, **kwargs) -> "FakeCollection":
+        return self
+
+    def limit(self, count: int) -> "FakeCollection":
+        return self
+
+    def offset(self, num_to_skip: int) -> "FakeCollection":
+        return self
+
+    def order_by(self, *args, **kwargs) -> "FakeCollection":
+        return self
+
+    def stream(self) -> Iterator[FakeDocSnap]:
+        return iter([doc for doc in self.docs.values() if doc.exists])
+
 # Patches for Firebase modules (but don't start them automatically)
 firebase_admin_patch = patch.dict('sys.modules', {
     'firebase_admin': Mock(),
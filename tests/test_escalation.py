@@ -61,7 +61,6 @@ class TestEscalationDetection:
         for message in normal_messages:
             assert not _check_do_not_contact_patterns(message), f"False positive: {message}"
 
-    @pytest.mark.asyncio
     async def test_violence_threats_escalate(self, customer_data, message_history):
         """Test that violent threats are escalated immediately"""
         violent_messages = [
@@ -83,7 +82,6 @@ class TestEscalationDetection:
             assert auto_reply is not None, f"Should send acknowledgment for: {message}"
             assert is_do_not_contact == False, f"Violence != do_not_contact: {message}"
 
-    @pytest.mark.asyncio
     async def test_legal_threats_escalate(self, customer_data, message_history):
         """Test that legal threats are escalated immediately"""
         legal_messages = [
@@ -105,7 +103,6 @@ class TestEscalationDetection:
             assert auto_reply is not None, f"Should send acknowledgment for: {message}"
             assert is_do_not_contact == False, f"Legal != do_not_contact: {message}"
 
-    @pytest.mark.asyncio
     async def test_do_not_contact_no_response(self, customer_data, message_history):
         """Test that do-not-contact requests get NO response"""
         do_not_contact_messages = [
@@ -123,7 +120,6 @@ class TestEscalationDetection:
             assert is_do_not_contact == True, f"Should be do_not_contact: {message}"
             assert auto_reply is None, f"Should be silent for: {message}"
 
-    @pytest.mark.asyncio
     async def test_medical_concerns_escalate(self, customer_data, message_history):
         """Test that medical concerns are escalated"""
         medical_messages = [
@@ -144,7 +140,6 @@ class TestEscalationDetection:
             assert should_escalate == True, f"Failed to escalate medical concern: {message}"
             assert auto_reply is not None, f"Should send acknowledgment for: {message}"
 
-    @pytest.mark.asyncio
     async def test_angry_complaints_escalate(self, customer_data, message_history):
         """Test that angry complaints are escalated"""
         angry_messages = [
@@ -165,7 +160,6 @@ class TestEscalationDetection:
             assert should_escalate == True, f"Failed to escalate angry complaint: {message}"
             assert auto_reply is not None, f"Should send acknowledgment for: {message}"
 
-    @pytest.mark.asyncio
     async def test_normal_questions_no_escalation(self, customer_data, message_history):
         """Test that normal questions don't escalate"""
         normal_messages = [
@@ -203,7 +197,6 @@ class TestServiceHallucination:
     def message_history(self):
         return []
 
-    @pytest.mark.asyncio
     async def test_non_existent_services_not_claimed(self, customer_data, message_history):
         """Test that AI doesn't claim to have services not in business config"""
         non_existent_services = [
@@ -244,7 +237,6 @@ class TestServiceHallucination:
                 "yes, we have", "we offer", "available", "our sauna", "our pool"
             ]), f"Response incorrectly claims to have service: {auto_reply}"
 
-    @pytest.mark.asyncio
     async def test_actual_services_confirmed(self, customer_data, message_history):
         """Test that AI correctly confirms actual services from business config"""
         actual_services = [
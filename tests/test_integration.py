@@ -5,22 +5,46 @@ Run with: python -m pytest tests/test_integration_real.py -v
 """
 
 import pytest
+import pytest_asyncio
 import asyncio
+import re
+import httpx
+from contextlib import contextmanager
 from fastapi.testclient import TestClient
 from datetime import datetime
-import os
 
 # Import the FastAPI app
 from app.main import app
 from app.models import CustomerCreate, MessageSend
 
 # Create test client
-client = TestClient(app)
+client = TestClient(app, backend="asyncio", raise_server_exceptions=False)
 
 # Test data
 VALID_API_KEY = "sms_backend_2025_secure_key_xyz789"
 
+# OpenAI errors that mean "account can't serve requests right now" rather than a real failure
+_SKIP_RE = re.compile(r"quota|billing|rate.?limit", re.I)
+
+@contextmanager
+def openai_skippable():
+    """Skip the current test on OpenAI quota/billing/rate-limit errors, re-raise anything else."""
+    try:
+        yield
+    except Exception as e:
+        if _SKIP_RE.search(str(e)):
+            pytest.skip(f"OpenAI API quota/billing issue: {str(e)}")
+        raise
+
+@pytest_asyncio.fixture
+async def ac():
+    """Async client that talks to the app in-process, without TestClient's thread hop."""
+    # Follow the routers' trailing-slash redirects like TestClient does
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", follow_redirects=True) as c:
+        yield c
+
 @pytest.mark.integration
+@pytest.mark.firebase
 class TestFirebaseIntegrationReal:
     """Integration tests using real Firebase."""
     
@@ -146,10 +170,6 @@ class TestOpenAIIntegrationReal:
         """Test real OpenAI API for outbound message generation."""
         from app.utils.llm_client import generate_outbound_message
         
-        # Skip if OpenAI API key not configured
-        if not os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY") == "test_openai_key":
-            pytest.skip("OpenAI API key not configured for integration testing")
-        
         customer_data = {
             "name": "John Doe",
             "phone": "+1234567890",
@@ -158,7 +178,7 @@ class TestOpenAIIntegrationReal:
             "notes": "Frequent customer, likes personalized service"
         }
         
-        try:
+        with openai_skippable():
             result = await generate_outbound_message(customer_data, "Follow-up after recent visit")
             
             # Verify the result is reasonable
@@ -166,25 +186,15 @@ class TestOpenAIIntegrationReal:
             assert len(result) > 10  # Should be a meaningful message
             assert len(result) <= 160  # Should be SMS-appropriate length
             assert "John" in result or "customer" in result.lower()  # Should be personalized
-            
-        except Exception as e:
-            if "quota" in str(e).lower() or "billing" in str(e).lower():
-                pytest.skip(f"OpenAI API quota/billing issue: {str(e)}")
-            else:
-                raise
     
     async def test_generate_auto_reply_real_openai(self):
         """Test real OpenAI API for auto-reply generation."""
         from app.utils.llm_client import generate_auto_reply
         
-        # Skip if OpenAI API key not configured
-        if not os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY") == "test_openai_key":
-            pytest.skip("OpenAI API key not configured for integration testing")
-        
         customer_data = {"name": "Jane Smith", "phone": "+1987654321"}
         incoming_message = "What are your business hours?"
         
-        try:
+        with openai_skippable():
             reply, escalate, is_do_not_contact = await generate_auto_reply(incoming_message, customer_data, [])
             
             # Verify the result
@@ -197,21 +207,11 @@ class TestOpenAIIntegrationReal:
                 assert escalate is False
                 assert is_do_not_contact is False
                 assert any(word in reply.lower() for word in ["hour", "open", "time", "monday", "friday"])
-            
-        except Exception as e:
-            if "quota" in str(e).lower() or "billing" in str(e).lower():
-                pytest.skip(f"OpenAI API quota/billing issue: {str(e)}")
-            else:
-                raise
     
     async def test_analyze_message_sentiment_real_openai(self):
         """Test real OpenAI API for sentiment analysis."""
         from app.utils.llm_client import analyze_message_sentiment
         
-        # Skip if OpenAI API key not configured
-        if not os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY") == "test_openai_key":
-            pytest.skip("OpenAI API key not configured for integration testing")
-        
         test_messages = [
             ("I love your service! Thank you so much!", "positive"),
             ("I'm very disappointed with my experience", "negative"),
@@ -219,7 +219,7 @@ class TestOpenAIIntegrationReal:
         ]
         
         for message, expected_sentiment in test_messages:
-            try:
+            with openai_skippable():
                 result = await analyze_message_sentiment(message)
                 
                 # Verify the result structure
@@ -237,12 +237,6 @@ class TestOpenAIIntegrationReal:
                 # For this simple test, we'll just check that sentiment is detected
                 # (exact matching is hard due to AI variability)
                 print(f"Message: '{message}' -> Sentiment: {result['sentiment']} (expected: {expected_sentiment})")
-                
-            except Exception as e:
-                if "quota" in str(e).lower() or "billing" in str(e).lower():
-                    pytest.skip(f"OpenAI API quota/billing issue: {str(e)}")
-                else:
-                    raise
 
 @pytest.mark.integration
 @pytest.mark.twilio
@@ -254,13 +248,6 @@ class TestTwilioIntegrationReal:
         """Test real Twilio API for SMS sending."""
         from app.utils.twilio_client import send_sms
         
-        # Skip if Twilio not configured
-        if (not os.getenv("TWILIO_ACCOUNT_SID") or 
-            not os.getenv("TWILIO_AUTH_TOKEN") or
-            not os.getenv("TWILIO_PHONE_NUMBER") or
-            os.getenv("TWILIO_ACCOUNT_SID") == "test_twilio_sid"):
-            pytest.skip("Twilio not configured for integration testing")
-        
         # Use a verified test number for Twilio (you need to verify this in Twilio console)
         test_phone = "+15005550006"  # Twilio magic number for testing
         test_message = f"Integration test message {datetime.now().isoformat()}"
@@ -284,12 +271,6 @@ class TestTwilioIntegrationReal:
         """Test real Twilio API for account balance."""
         from app.utils.twilio_client import get_account_balance
         
-        # Skip if Twilio not configured
-        if (not os.getenv("TWILIO_ACCOUNT_SID") or 
-            not os.getenv("TWILIO_AUTH_TOKEN") or
-            os.getenv("TWILIO_ACCOUNT_SID") == "test_twilio_sid"):
-            pytest.skip("Twilio not configured for integration testing")
-        
         try:
             balance = await get_account_balance()
             
@@ -304,6 +285,8 @@ class TestTwilioIntegrationReal:
                 raise
 
 @pytest.mark.integration
+@pytest.mark.firebase
+@pytest.mark.openai
 class TestEndToEndScenarios:
     """End-to-end integration tests combining multiple services."""
     
@@ -311,7 +294,7 @@ class TestEndToEndScenarios:
     def auth_headers(self):
         return {"X-API-Key": VALID_API_KEY, "Content-Type": "application/json"}
     
-    async def test_complete_outbound_message_flow(self, auth_headers):
+    async def test_complete_outbound_message_flow(self, ac, auth_headers):
         """Test complete flow: create customer, generate AI message, create message record."""
         # Create a test customer
         customer_data = {
@@ -321,7 +304,7 @@ class TestEndToEndScenarios:
             "tags": ["e2e-test", "outbound-flow"]
         }
         
-        create_response = client.post("/customers", headers=auth_headers, json=customer_data)
+        create_response = await ac.post("/customers", headers=auth_headers, json=customer_data)
         
         if create_response.status_code == 500:
             pytest.skip("Firebase not configured for integration testing")
@@ -335,7 +318,7 @@ class TestEndToEndScenarios:
                 "context": "Welcome message for new customer"
             }
             
-            send_response = client.post("/messages/send", headers=auth_headers, json=send_data)
+            send_response = await ac.post("/messages/send", headers=auth_headers, json=send_data)
             
             if send_response.status_code == 500 and "openai" in send_response.text.lower():
                 pytest.skip("OpenAI not configured for integration testing")
@@ -352,8 +335,13 @@ class TestEndToEndScenarios:
             message_id = sent_response["data"]["message_id"]
             content = sent_response["data"]["content"]
             
-            # Verify message was stored
-            messages_response = client.get(f"/messages?customer_id={customer_id}", headers=auth_headers)
+            # Verify message was stored (both lookups are independent, so fetch them concurrently)
+            message_response, messages_response = await asyncio.gather(
+                ac.get(f"/messages/{message_id}", headers=auth_headers),
+                ac.get(f"/messages?customer_id={customer_id}", headers=auth_headers)
+            )
+            assert message_response.status_code == 200
+            assert message_response.json()["id"] == message_id
             assert messages_response.status_code == 200
             messages = messages_response.json()
             assert len(messages) >= 1
@@ -367,7 +355,7 @@ class TestEndToEndScenarios:
             
         finally:
             # Clean up
-            delete_response = client.delete(f"/customers/{customer_id}", headers=auth_headers)
+            delete_response = await ac.delete(f"/customers/{customer_id}", headers=auth_headers)
             assert delete_response.status_code == 200
 
 if __name__ == "__main__":
@@ -5,222 +5,228 @@ Run with: python -m pytest tests/test_performance.py -v
 
 import pytest
 import asyncio
+import sys
 import time
-from concurrent.futures import ThreadPoolExecutor
-from fastapi.testclient import TestClient
-from app.main import app
 
-client = TestClient(app)
 VALID_API_KEY = "sms_backend_2025_secure_key_xyz789"
 
+# Large customer with many tags, built once so payload construction stays out of the timed region
+_LARGE_CUSTOMER = {
+    "name": "Test Customer with Very Long Name " * 10,
+    "phone": "+1234567890",
+    "notes": "Very long notes " * 100,  # ~1600 characters
+    "tags": [f"tag_{i}" for i in range(100)]  # 100 tags
+}
+
+def _rss_bytes():
+    """Peak resident set size of this process in bytes."""
+    if sys.platform == "win32":
+        import os
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().peak_wset
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
 class TestPerformance:
     """Performance tests for the API."""
     
-    def test_health_check_response_time(self):
+    def test_health_check_response_time(self, client):
         """Test that health check responds quickly."""
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         response = client.get("/")
-        end_time = time.time()
+        end_ns = time.perf_counter_ns()
         
         assert response.status_code == 200
-        response_time = end_time - start_time
+        response_time = (end_ns - start_ns) / 1e9
         assert response_time < 1.0, f"Health check took {response_time:.2f}s, should be under 1s"
     
-    def test_concurrent_health_checks(self):
+    async def test_concurrent_health_checks(self, async_client):
         """Test handling multiple concurrent health check requests."""
-        def make_request():
-            return client.get("/")
-        
         # Run 10 concurrent requests
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            start_time = time.time()
-            futures = [executor.submit(make_request) for _ in range(10)]
-            responses = [future.result() for future in futures]
-            end_time = time.time()
+        start_ns = time.perf_counter_ns()
+        responses = await asyncio.gather(*(async_client.get("/") for _ in range(10)))
+        end_ns = time.perf_counter_ns()
         
         # All requests should succeed
         for response in responses:
             assert response.status_code == 200
         
         # Should complete within reasonable time
-        total_time = end_time - start_time
+        total_time = (end_ns - start_ns) / 1e9
         assert total_time < 5.0, f"10 concurrent requests took {total_time:.2f}s"
     
-    def test_auth_validation_performance(self):
+    def test_auth_validation_performance(self, client, fake_customers):
         """Test that authentication validation is fast."""
         headers = {"X-API-Key": VALID_API_KEY}
         
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         response = client.get("/customers", headers=headers)
-        end_time = time.time()
+        end_ns = time.perf_counter_ns()
         
-        # Should respond quickly even if Firebase fails
-        # Note: First request may be slower due to Firebase initialization
-        response_time = end_time - start_time
-        assert response_time < 10.0, f"Auth validation took {response_time:.2f}s"
+        assert response.status_code == 200
+        response_time = (end_ns - start_ns) / 1e9
+        assert response_time < 1.0, f"Auth validation took {response_time:.2f}s"
     
-    def test_invalid_auth_performance(self):
+    def test_invalid_auth_performance(self, client):
         """Test that invalid auth is rejected quickly."""
         headers = {"X-API-Key": "invalid_key"}
         
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         response = client.get("/customers", headers=headers)
-        end_time = time.time()
+        end_ns = time.perf_counter_ns()
         
         assert response.status_code == 401
-        response_time = end_time - start_time
+        response_time = (end_ns - start_ns) / 1e9
         assert response_time < 0.5, f"Invalid auth rejection took {response_time:.2f}s"
     
-    def test_large_request_handling(self):
+    def test_large_request_handling(self, client, fake_customers):
         """Test handling of large request payloads."""
         headers = {"X-API-Key": VALID_API_KEY, "Content-Type": "application/json"}
         
-        # Create a large customer with many tags
-        large_customer = {
-            "name": "Test Customer with Very Long Name " * 10,
-            "phone": "+1234567890",
-            "notes": "Very long notes " * 100,  # ~1600 characters
-            "tags": [f"tag_{i}" for i in range(100)]  # 100 tags
-        }
-        
-        start_time = time.time()
-        response = client.post("/customers", headers=headers, json=large_customer)
-        end_time = time.time()
+        start_ns = time.perf_counter_ns()
+        response = client.post("/customers", headers=headers, json=_LARGE_CUSTOMER)
+        end_ns = time.perf_counter_ns()
         
-        # Should handle large requests (may fail due to Firebase but shouldn't timeout)
-        response_time = end_time - start_time
+        # Should handle large requests without timing out
+        response_time = (end_ns - start_ns) / 1e9
         assert response_time < 5.0, f"Large request took {response_time:.2f}s"
-        assert response.status_code in [200, 422, 500]  # Valid responses
+        assert response.status_code == 200
 
 class TestScalability:
     """Test scalability considerations."""
     
-    def test_pagination_performance(self):
+    @pytest.mark.parametrize("endpoint", [
+        "/customers?limit=10&offset=0",
+        "/customers?limit=100&offset=0",
+        "/customers?limit=10&offset=100",
+        "/messages?limit=50&offset=0",
+        "/messages?customer_id=test&limit=20&offset=10"
+    ])
+    def test_pagination_performance(self, client, fake_customers, fake_messages, endpoint):
         """Test that pagination parameters don't slow down requests significantly."""
         headers = {"X-API-Key": VALID_API_KEY}
         
-        # Test different pagination parameters
-        test_cases = [
-            "/customers?limit=10&offset=0",
-            "/customers?limit=100&offset=0",
-            "/customers?limit=10&offset=100",
-            "/messages?limit=50&offset=0",
-            "/messages?customer_id=test&limit=20&offset=10"
-        ]
-        
-        for endpoint in test_cases:
-            start_time = time.time()
-            response = client.get(endpoint, headers=headers)
-            end_time = time.time()
-            
-            response_time = end_time - start_time
-            assert response_time < 3.0, f"Paginated request {endpoint} took {response_time:.2f}s"
-            assert response.status_code in [200, 500]  # Valid responses
+        start_ns = time.perf_counter_ns()
+        response = client.get(endpoint, headers=headers)
+        end_ns = time.perf_counter_ns()
+        
+        response_time = (end_ns - start_ns) / 1e9
+        assert response_time < 3.0, f"Paginated request {endpoint} took {response_time:.2f}s"
+        assert response.status_code == 200
     
-    def test_concurrent_different_endpoints(self):
+    async def test_concurrent_different_endpoints(self, async_client, fake_customers, fake_messages):
         """Test handling concurrent requests to different endpoints."""
         headers = {"X-API-Key": VALID_API_KEY}
         
-        def make_requests():
-            endpoints = [
-                ("/", "GET", {}),
-                ("/customers", "GET", headers),
-                ("/messages", "GET", headers),
-                ("/customers/search/phone?phone=+1234567890", "GET", headers)
-            ]
-            
-            results = []
-            for endpoint, method, req_headers in endpoints:
-                if method == "GET":
-                    response = client.get(endpoint, headers=req_headers)
-                    results.append(response.status_code)
-            return results
-        
-        # Run concurrent requests to different endpoints
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            start_time = time.time()
-            futures = [executor.submit(make_requests) for _ in range(5)]
-            all_results = [future.result() for future in futures]
-            end_time = time.time()
+        # Each endpoint with the status it should return (the phone search finds no customer)
+        cases = [
+            ("/", {}, 200),
+            ("/customers", headers, 200),
+            ("/messages", headers, 200),
+            ("/customers/search/phone?phone=+1234567890", headers, 404)
+        ] * 5
+        
+        # Run 5 rounds of concurrent requests to different endpoints as one gather
+        start_ns = time.perf_counter_ns()
+        responses = await asyncio.gather(*(async_client.get(url, headers=h) for url, h, _ in cases))
+        end_ns = time.perf_counter_ns()
         
         # Should complete within reasonable time
-        total_time = end_time - start_time
+        total_time = (end_ns - start_ns) / 1e9
         assert total_time < 10.0, f"Concurrent mixed requests took {total_time:.2f}s"
         
-        # All requests should get valid responses
-        for results in all_results:
-            for status_code in results:
-                assert status_code in [200, 401, 404, 500]  # Valid status codes
+        # Every response should match its own endpoint's expected status
+        for (url, _, expected), response in zip(cases, responses):
+            assert response.status_code == expected, f"{url} returned {response.status_code}"
 
 class TestMemoryUsage:
     """Test memory usage patterns."""
     
-    def test_request_memory_cleanup(self):
+    @pytest.mark.xdist_group("serial")
+    def test_request_memory_cleanup(self, client):
         """Test that requests don't leak memory."""
         import gc
-        import psutil
-        import os
-        
-        process = psutil.Process(os.getpid())
-        initial_memory = process.memory_info().rss
+        import tracemalloc
         
         headers = {"X-API-Key": VALID_API_KEY}
         
-        # Make many requests
-        for i in range(50):
-            client.get("/", headers={})
-            client.get("/customers", headers=headers)
-            
-            # Force garbage collection periodically
-            if i % 10 == 0:
-                gc.collect()
+        # Start from a clean heap and keep the collector out of the request loop
+        gc.collect()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        initial_memory = _rss_bytes()
+        initial_traced, _ = tracemalloc.get_traced_memory()
+        
+        gc.disable()
+        try:
+            # Make many requests
+            for _ in range(50):
+                client.get("/", headers={})
+                client.get("/customers", headers=headers)
+        finally:
+            gc.enable()
+        
+        # Free everything unreachable once, right before measuring
+        gc.collect()
+        final_memory = _rss_bytes()
+        final_traced, _ = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
         
-        final_memory = process.memory_info().rss
         memory_increase = final_memory - initial_memory
+        traced_increase = final_traced - initial_traced
         
         # Memory increase should be reasonable (less than 50MB)
         assert memory_increase < 50 * 1024 * 1024, f"Memory increased by {memory_increase / 1024 / 1024:.2f}MB"
+        # Cross-check with Python allocator bytes, which glibc arena fragmentation doesn't inflate
+        assert traced_increase < 50 * 1024 * 1024, f"Traced memory increased by {traced_increase / 1024 / 1024:.2f}MB"
 
 class TestErrorHandlingPerformance:
     """Test performance under error conditions."""
     
-    def test_404_response_time(self):
+    def test_404_response_time(self, client):
         """Test that 404 responses are fast."""
         headers = {"X-API-Key": VALID_API_KEY}
         
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         response = client.get("/nonexistent-endpoint", headers=headers)
-        end_time = time.time()
+        end_ns = time.perf_counter_ns()
         
         assert response.status_code == 404
-        response_time = end_time - start_time
+        response_time = (end_ns - start_ns) / 1e9
         assert response_time < 0.5, f"404 response took {response_time:.2f}s"
     
-    def test_validation_error_performance(self):
+    def test_validation_error_performance(self, client):
         """Test that validation errors are handled quickly."""
         headers = {"X-API-Key": VALID_API_KEY, "Content-Type": "application/json"}
         
         invalid_data = {"invalid": "data"}
         
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         response = client.post("/customers", headers=headers, json=invalid_data)
-        end_time = time.time()
+        end_ns = time.perf_counter_ns()
         
         assert response.status_code == 422  # Validation error
-        response_time = end_time - start_time
+        response_time = (end_ns - start_ns) / 1e9
         assert response_time < 1.0, f"Validation error response took {response_time:.2f}s"
     
-    def test_multiple_auth_failures(self):
+    async def test_multiple_auth_failures(self, async_client):
         """Test handling multiple authentication failures quickly."""
         invalid_headers = {"X-API-Key": "definitely_invalid_key"}
         
-        start_time = time.time()
-        for _ in range(20):
-            response = client.get("/customers", headers=invalid_headers)
+        # Warm up the route before timing (canonical path: one auth rejection per request, no redirect hop)
+        await async_client.get("/customers/", headers=invalid_headers)
+        
+        start_ns = time.perf_counter_ns()
+        responses = await asyncio.gather(*(async_client.get("/customers/", headers=invalid_headers) for _ in range(20)))
+        total_time = (time.perf_counter_ns() - start_ns) / 1e9
+        
+        for response in responses:
             assert response.status_code == 401
-        end_time = time.time()
         
-        total_time = end_time - start_time
         avg_time = total_time / 20
         assert avg_time < 0.1, f"Average auth failure response time: {avg_time:.3f}s"
 
@@ -228,23 +234,22 @@ class TestDatabasePerformance:
     """Test database-related performance."""
     
     @pytest.mark.integration
-    def test_database_connection_performance(self):
-        """Test database connection establishment time."""
+    @pytest.mark.firebase
+    def test_database_connection_performance(self, firebase_available):
+        """Test that retrieving the shared database client is cheap once initialized."""
+        if not firebase_available:
+            pytest.skip("Firebase not configured")
         from app.database import get_firestore_client
         
-        # Test multiple database client retrievals
-        start_time = time.time()
+        # Test multiple database client retrievals (firebase_available already paid initialization)
+        start_ns = time.perf_counter_ns()
         for _ in range(10):
-            try:
-                client = get_firestore_client()
-            except Exception:
-                # Expected if Firebase not configured
-                pass
-        end_time = time.time()
-        
-        total_time = end_time - start_time
+            get_firestore_client()
+        end_ns = time.perf_counter_ns()
+        
+        total_time = (end_ns - start_ns) / 1e9
         avg_time = total_time / 10
-        assert avg_time < 0.5, f"Average database client retrieval: {avg_time:.3f}s"
+        assert avg_time < 0.001, f"Average database client retrieval: {avg_time:.6f}s"
 
 # Performance test configuration
 def pytest_configure(config):